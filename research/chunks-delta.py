@@ -2,10 +2,11 @@ from srcs.parsers.block import BlockParser
 from srcs.model.chunks import Chunk
 from srcs.utils.ids import strencode
 from pathlib import Path
-from typing import Generic, TypeVar, NamedTuple
+from typing import Generic, Iterable, TypeVar, NamedTuple
 from dataclasses import dataclass
 
 import re
+import sys
 import difflib
 
 
@@ -27,15 +28,6 @@ class Delta(Generic[T]):
     removed: list[T]
 
 
-class TextChunk(NamedTuple):
-    chunk: Chunk
-    text: str
-
-    @staticmethod
-    def Load(chunk: Chunk) -> "TextChunk":
-        return TextChunk(chunk, Chunk.Read(chunk).decode("utf-8"))
-
-
 # NOTE: The key challenge here is to find which chunks may be a variant of another chunk. This
 # is definitely a tricky thing to do.
 
@@ -46,42 +38,58 @@ def words(text: str) -> list[str]:
     return RE_NONWORD.sub(" ", text).strip().split()
 
 
+# NOTE: Soundex codes are obtained by translating the ASCII bytes of the word
+# through a lookup table, deleting the bytes that have no code, and collapsing
+# repeated digits, so that the per-character work happens in C.
+SOUNDEX_CODES: dict[bytes, bytes] = {
+    b"BFPV": b"1",
+    b"CGJKQSXZ": b"2",
+    b"DT": b"3",
+    b"L": b"4",
+    b"MN": b"5",
+    b"R": b"6",
+}
+SOUNDEX_TABLE: bytes = bytes.maketrans(
+    b"".join(SOUNDEX_CODES), b"".join(v * len(k) for k, v in SOUNDEX_CODES.items())
+)
+SOUNDEX_DELETE: bytes = bytes(_ for _ in range(256) if _ not in b"".join(SOUNDEX_CODES))
+RE_NONALPHA = re.compile(r"[\W\d_]+")
+RE_REPEATED_BYTES = re.compile(rb"(.)\1+")
+
+
 # FROM: ChatGPT
 def soundex(word: str):
-    # Step 1: Convert the word to uppercase
-    word = word.upper()
-    # Step 2: Remove non-alphabetic characters and convert to uppercase
-    word = "".join(char for char in word if char.isalpha())
-    # Step 3: Handle empty and single-letter words
+    # Step 1: Convert the word to uppercase and remove non-alphabetic characters
+    word = RE_NONALPHA.sub("", word.upper())
+    # Step 2: Handle empty and single-letter words
     if not word or len(word) == 1:
         return word
-    # Step 4: Replace consonants with appropriate digits
-    soundex_mapping = {
-        "BFPV": "1",
-        "CGJKQSXZ": "2",
-        "DT": "3",
-        "L": "4",
-        "MN": "5",
-        "R": "6",
-    }
+    # Step 3: Replace consonants with appropriate digits, removing the rest
     first_letter = word[0]
-    soundex_code = first_letter
-    for char in word[1:]:
-        for key, value in soundex_mapping.items():
-            if char in key:
-                if value != soundex_code[-1]:
-                    soundex_code += value
-    # Step 5: Remove vowels and digits that repeat consecutively
-    soundex_code = soundex_code[1:]
-    soundex_code = "".join(
-        char
-        for idx, char in enumerate(soundex_code)
-        if idx == 0 or char != soundex_code[idx - 1]
+    soundex_code = (
+        word[1:].encode("ascii", "ignore").translate(SOUNDEX_TABLE, SOUNDEX_DELETE)
     )
-    # Step 6: Pad with zeros to get a 4-character code
-    soundex_code = soundex_code.ljust(3, "0")
+    # Step 4: Remove digits that repeat consecutively
+    soundex_code = RE_REPEATED_BYTES.sub(rb"\1", soundex_code)
+    # Step 5: Pad with zeros to get a 4-character code
+    return first_letter + soundex_code.decode("ascii").ljust(3, "0")
 
-    return first_letter + soundex_code
+
+class TextChunk(NamedTuple):
+    chunk: Chunk
+    text: str
+    # NOTE: The soundex tokens are calculated once on load, as they are
+    # compared against every other chunk in `DifferChunks.Relate`.
+    tokens: tuple[str, ...]
+    tokenSet: frozenset[str]
+
+    @staticmethod
+    def Load(chunk: Chunk) -> "TextChunk":
+        text = Chunk.Read(chunk).decode("utf-8")
+        # NOTE: Tokens are interned, so that the same token is shared across
+        # chunks and compared by identity in the matcher.
+        tokens = tuple(sys.intern(soundex(_)) for _ in words(text))
+        return TextChunk(chunk, text, tokens, frozenset(tokens))
 
 
 class ChunksDiff(NamedTuple):
@@ -90,60 +98,136 @@ class ChunksDiff(NamedTuple):
     changed: list[tuple[TextChunk, TextChunk]]
 
 
+# NOTE: Most pairs of chunks have almost no tokens in common, comparing
+# their token sets is much cheaper than running the sequence matcher.
+SIMILARITY_THRESHOLD: float = 0.2
+
+
 class DifferChunks:
     @staticmethod
-    def Distance(chunk: TextChunk, other: TextChunk) -> int:
-        # NOTE: Here we use words and soundex to normalize. Obviously
-        # we should have pre-calculate the soundex words.
-        matcher = difflib.SequenceMatcher(
-            None,
-            ta := [soundex(_) for _ in words(chunk.text)],
-            tb := [soundex(_) for _ in words(other.text)],
+    def Similarity(chunk: TextChunk, other: TextChunk) -> float:
+        """Returns the Jaccard index of the chunks' token sets."""
+        return len(chunk.tokenSet & other.tokenSet) / max(
+            1, len(chunk.tokenSet | other.tokenSet)
         )
+
+    @staticmethod
+    def Score(matcher: difflib.SequenceMatcher) -> int:
+        """Returns the score for the sequences set in the given matcher."""
         matches = matcher.get_matching_blocks()
         # The higher the number, the more common
         return sum(_.size + 1 for _ in matches)
 
+    @classmethod
+    def Distance(cls, chunk: TextChunk, other: TextChunk) -> int:
+        # NOTE: Here we use words and soundex to normalize, the tokens
+        # are pre-calculated by `TextChunk.Load`.
+        return cls.Score(
+            difflib.SequenceMatcher(None, chunk.tokens, other.tokens, autojunk=False)
+        )
+
+    @classmethod
+    def Match(cls, scores: list[list[int]]) -> dict[int, int]:
+        """Returns the one-to-one mapping of rows to columns that maximizes
+        the total score, using the Hungarian algorithm."""
+        n: int = len(scores)
+        m: int = len(scores[0]) if n else 0
+        if not (n and m):
+            return {}
+        elif n > m:
+            # The algorithm requires at least as many columns as rows
+            return {
+                i: j for j, i in cls.Match([list(_) for _ in zip(*scores)]).items()
+            }
+        # NOTE: This is the classic O(n²m) formulation with potentials, using
+        # 1-based indices where the column 0 is a sentinel. We minimize the
+        # negated scores.
+        u: list[float] = [0] * (n + 1)
+        v: list[float] = [0] * (m + 1)
+        p: list[int] = [0] * (m + 1)
+        way: list[int] = [0] * (m + 1)
+        for i in range(1, n + 1):
+            p[0] = i
+            j0: int = 0
+            minv: list[float] = [float("inf")] * (m + 1)
+            used: list[bool] = [False] * (m + 1)
+            while True:
+                used[j0] = True
+                i0: int = p[j0]
+                row = scores[i0 - 1]
+                delta: float = float("inf")
+                j1: int = 0
+                for j in range(1, m + 1):
+                    if not used[j]:
+                        if (cur := -row[j - 1] - u[i0] - v[j]) < minv[j]:
+                            minv[j] = cur
+                            way[j] = j0
+                        if minv[j] < delta:
+                            delta = minv[j]
+                            j1 = j
+                for j in range(m + 1):
+                    if used[j]:
+                        u[p[j]] += delta
+                        v[j] -= delta
+                    else:
+                        minv[j] -= delta
+                j0 = j1
+                if p[j0] == 0:
+                    break
+            while j0:
+                j1 = way[j0]
+                p[j0] = p[j1]
+                j0 = j1
+        return {p[j] - 1: j - 1 for j in range(1, m + 1) if p[j]}
+
     @classmethod
     def Relate(cls, a: list[TextChunk], b: list[TextChunk]) -> ChunksDiff:
-        distance: dict[int, dict[int, int]] = {}
+        # NOTE: The distance matrix is dense, row `i` has the scores of `a[i]`
+        # against each chunk of `b`.
+        distance: list[list[int]] = [[0] * len(b) for _ in a]
         matched: dict[int, int] = {}
-        for i, c in enumerate(a):
-            distance[i] = {j: cls.Distance(c, d) for j, d in enumerate(b)}
-        for i, c in enumerate(a):
-            k = max(distance[i].values())
-            for j, kk in distance[i].items():
-                if kk == k:
-                    print("===\nMATCHED", i, j)
-                    print(f"A={a[i].text}")
-                    print(f"B={b[j].text}")
-                    matched[i] = j
-                    break
+        # NOTE: The matcher caches information about the second sequence, so
+        # we set it once per chunk in `b` and iterate on `a` for the first.
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        for j, d in enumerate(b):
+            matcher.set_seq2(d.tokens)
+            for i, c in enumerate(a):
+                # We skip the matcher for chunks that have too few
+                # tokens in common, leaving their score to 0.
+                if cls.Similarity(c, d) >= SIMILARITY_THRESHOLD:
+                    matcher.set_seq1(c.tokens)
+                    distance[i][j] = cls.Score(matcher)
+        # Chunks are matched one-to-one, a score of 1 means that there
+        # is no common token.
+        for i, j in cls.Match(distance).items():
+            if distance[i][j] > 1:
+                print("===\nMATCHED", i, j)
+                print(f"A={a[i].text}")
+                print(f"B={b[j].text}")
+                matched[i] = j
+        matched_b: set[int] = set(matched.values())
         removed: list[TextChunk] = [_ for i, _ in enumerate(a) if i not in matched]
-        added: list[TextChunk] = [
-            _ for j, _ in enumerate(b) if j not in matched.values()
-        ]
+        added: list[TextChunk] = [_ for j, _ in enumerate(b) if j not in matched_b]
         return ChunksDiff(added, removed, [(a[i], b[j]) for i, j in matched.items()])
 
 
-def diffChunks(a: list[Chunk], b: list[Chunk]) -> Delta[Chunk]:
-    sig_a: dict[bytes, Chunk] = {_.signature.hash: _ for _ in a}
-    sig_b: dict[bytes, Chunk] = {_.signature.hash: _ for _ in b}
+# NOTE: Chunks are indexed by the first 64 bits of their signature as an
+# integer, which is plenty to avoid collisions at this scale and hashes
+# as a single machine word. The full signature stays on the chunk.
+def signatureKey(chunk: Chunk) -> int:
+    return int.from_bytes(chunk.signature.hash[:8], "little")
 
-    # Create the engine with the given configuration
-    removed: set[bytes] = set()
-    common: set[bytes] = set()
-    added: set[bytes] = set()
+
+def diffChunks(a: Iterable[Chunk], b: Iterable[Chunk]) -> Delta[Chunk]:
+    # NOTE: Both sides are consumed once, so the parser generators can be
+    # passed directly without materialising a list of chunks first.
+    sig_a: dict[int, Chunk] = {signatureKey(_): _ for _ in a}
+    sig_b: dict[int, Chunk] = {signatureKey(_): _ for _ in b}
 
     # Common chunks are easy, they are exactly the same
-    for k in sig_a:
-        if k in sig_b:
-            common.add(k)
-        else:
-            removed.add(k)
-    for k in sig_b:
-        if k not in sig_a:
-            added.add(k)
+    common: set[int] = sig_a.keys() & sig_b.keys()
+    removed: set[int] = sig_a.keys() - sig_b.keys()
+    added: set[int] = sig_b.keys() - sig_a.keys()
 
     diff = DifferChunks.Relate(
         [TextChunk.Load(sig_a[_]) for _ in removed],
@@ -155,8 +239,11 @@ def diffChunks(a: list[Chunk], b: list[Chunk]) -> Delta[Chunk]:
 
 
 if __name__ == "__main__":
-    chunks_a = list(BlockParser.Chunks(Path("data/file-V0.py")))
-    chunks_b = list(BlockParser.Chunks(Path("data/file-V1.py")))
-    print(diffChunks(chunks_a, chunks_b))
+    print(
+        diffChunks(
+            BlockParser.Chunks(Path("data/file-V0.py")),
+            BlockParser.Chunks(Path("data/file-V1.py")),
+        )
+    )
 
 # EOF
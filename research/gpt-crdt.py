@@ -13,8 +13,9 @@
 
 
 from dataclasses import dataclass
-from typing import List, Optional, Union
-from uuid import uuid4
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Union
+import os
 
 
 @dataclass
@@ -30,29 +31,38 @@ class TextLine:
 class TextChunkCRDT:
     def __init__(self) -> None:
         self.lines: List[TextLine] = []
+        # NOTE: Lines are indexed by their unique ID, so that lookups don't
+        # need to scan the lines.
+        self.linesByID: Dict[str, TextLine] = {}
 
     def insert(self, content: str, position: int) -> None:
-        uniqueID = str(uuid4())
+        # NOTE: IDs need to be unique across replicas, 16 random bytes are
+        # as good as a UUID4 without the object construction.
+        uniqueID = os.urandom(16).hex()
         newLine = TextLine(content, position, uniqueID)
-        self.lines.append(newLine)
-        self.lines.sort(key=lambda line: line.position)
+        # NOTE: Lines are kept sorted as they are inserted, inserting after
+        # lines at the same position like a stable sort would.
+        insort(self.lines, newLine, key=lambda _: _.position)
+        self.linesByID[uniqueID] = newLine
 
     def delete(self, uniqueID: str) -> None:
-        self.lines = [line for line in self.lines if line.uniqueID != uniqueID]
+        if (line := self.linesByID.pop(uniqueID, None)) is not None:
+            # NOTE: Lines are sorted by position, so we only look at the lines
+            # sharing that position, comparing identity rather than equality.
+            i = bisect_left(self.lines, line.position, key=lambda _: _.position)
+            while self.lines[i] is not line:
+                i += 1
+            del self.lines[i]
 
     def update(self, uniqueID: str, newContent: str) -> None:
-        for line in self.lines:
-            if line.uniqueID == uniqueID:
-                line.content = newContent
-                break
+        if (line := self.linesByID.get(uniqueID)) is not None:
+            line.content = newContent
 
     def merge(self, otherCRDT: "TextChunkCRDT") -> None:
         for line in otherCRDT.lines:
-            if line.uniqueID not in [
-                existingLine.uniqueID for existingLine in self.lines
-            ]:
-                self.lines.append(line)
-        self.lines.sort(key=lambda line: line.position)
+            if line.uniqueID not in self.linesByID:
+                insort(self.lines, line, key=lambda _: _.position)
+                self.linesByID[line.uniqueID] = line
 
     def toString(self) -> str:
         return "\n".join([str(line) for line in self.lines])
@@ -63,10 +73,7 @@ class TextChunkCRDT:
             self.insert(line, idx)
 
     def getLine(self, uniqueID: str) -> Optional[TextLine]:
-        for line in self.lines:
-            if line.uniqueID == uniqueID:
-                return line
-        return None
+        return self.linesByID.get(uniqueID)
 
     def getLines(self) -> List[TextLine]:
         return self.lines
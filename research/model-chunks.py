@@ -1,10 +1,13 @@
-from typing import NamedTuple, Optional, Generic, TypeVar, Iterator
+from typing import NamedTuple, Optional, Generic, TypeVar, Iterator, Iterable
 from enum import Enum
 from dataclasses import dataclass
 from pathlib import Path
-from hashlib import sha512
-from uuid import uuid4
+from hashlib import blake2b, file_digest
+from itertools import count
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import re, os
+from srcs.utils.files import readRange
 
 T = TypeVar("T")
 
@@ -75,6 +78,7 @@ class Symbol(NamedTuple):
 
 class HashType(Enum):
     SHA512 = 1
+    BLAKE2B = 2
 
 
 class Signature(NamedTuple):
@@ -82,8 +86,7 @@ class Signature(NamedTuple):
     signature: bytes
 
 
-@dataclass
-class Chunk:
+class Chunk(NamedTuple):
     location: Location
     scope: Symbol
     range: Range
@@ -141,41 +144,62 @@ class Update(Generic[T]):
 # - Text files chunks are separated by one or more empty new lines.
 
 
+# NOTE: Binary detection deletes the text bytes from the read blocks, which
+# happens in C, anything left over means binary content.
+BINARY_BYTES: bytes = bytes(range(0x09)) + bytes(range(0x0E, 0x20))
+TEXT_BYTES: bytes = bytes(_ for _ in range(256) if _ not in BINARY_BYTES)
+
+
 def isBinary(path: Path) -> bool:
     """Checks if the given path has binary contents or not"""
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024), b""):
-            if b"\0" in chunk:
-                return True
-            if any(b < 0x09 or (0x0E <= b <= 0x1F) for b in chunk):
+        # Most binary files have a NUL byte early on, which we look for
+        # in a small first block before doing the full scan.
+        chunk = f.read(4096)
+        while chunk:
+            if b"\0" in chunk or chunk.translate(None, TEXT_BYTES):
                 return True
+            chunk = f.read(65536)
     return False
 
 
-def signature(
-    path: Path, start: Optional[int] = None, end: Optional[int] = None
-) -> Signature:
-    """Returns the SHA512 signature for the file at the given path, optionally taking
-    offsets to calculate the signature of a subset"""
-    h = sha512()
+# NOTE: Signatures use BLAKE2b, which is faster than SHA512 in software and
+# has the same 64 bytes digests. The hash type is recorded in the signature.
+def signatureFile(path: Path) -> Signature:
+    """Returns the BLAKE2b signature for the whole file at the given path."""
     with path.open("rb") as file:
-        if start:
-            file.seek(start)
-        if end is None:
-            for chunk in iter(lambda: file.read(1024), b""):
-                h.update(chunk)
-        else:
-            to_read = end - (start or 0)
-            while to_read > 0:
-                chunk = file.read(min(1024, to_read))
-                h.update(chunk)
-                to_read -= len(chunk)
-    return Signature(HashType.SHA512.value, h.digest())
+        return Signature(HashType.BLAKE2B.value, file_digest(file, blake2b).digest())
+
+
+def signatureBytes(data: bytes | memoryview) -> Signature:
+    """Returns the BLAKE2b signature for the given data, which is typically
+    a subset of a file that was already read."""
+    return Signature(HashType.BLAKE2B.value, blake2b(data).digest())
+
+
+# NOTE: Identifiers only need to be unique within a run, so we combine a
+# random per-process prefix with a counter instead of drawing a UUID for
+# each chunk.
+ID_PREFIX: str = os.urandom(6).hex()
+ID_COUNTER = count()
+
+
+def resetIDs() -> None:
+    """Draws a new prefix and restarts the counter, which forked processes
+    must do so that they don't generate the same identifiers."""
+    global ID_PREFIX, ID_COUNTER
+    ID_PREFIX = os.urandom(6).hex()
+    ID_COUNTER = count()
+
+
+# NOTE: Platforms without `fork` (Windows) have no `register_at_fork`.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetIDs)
 
 
 def makeID() -> str:
-    """Wrapper function to generate a UUID string identifier suitable"""
-    return str(uuid4())
+    """Wrapper function to generate a string identifier unique to the process"""
+    return f"{ID_PREFIX}{next(ID_COUNTER):x}"
 
 
 def isEmptyContent(chunk: bytes) -> bool:
@@ -191,85 +215,112 @@ def getLocation(path: Path, base: Path) -> Location:
 # NOTE: We probably want to implement per-file-format chunk iterator. We
 # should have simple ones like this one, then use ctypes, then use tree
 # sitter, then use AST like `python.ast`.
-RE_SEPARATOR_BYTES = re.compile(b"\r?\n([\t ]*\r?\n)+")
+# NOTE: The blank lines group doesn't need to capture, and the possessive
+# quantifier prevents backtracking on trailing whitespace.
+RE_SEPARATOR_BYTES = re.compile(rb"\r?\n(?:[\t ]*+\r?\n)+")
 
 
 def iterChunks(path: Path, base: Path = Path.cwd()) -> Iterator[Chunk]:
     """Iterates on the chunks available at the given `path`. This is typically
     what would be specialized with specific parsers to extract the structure."""
     loc = getLocation(path, base)
-    sym = Symbol([makeID()])
     if isBinary(path):
         yield Chunk(
             location=loc,
-            scope=sym,
+            scope=Symbol([makeID()]),
             range=Range(Position(0), Position(path.stat().st_size)),
-            signature=signature(path),
+            signature=signatureFile(path),
         )
     else:
         offset: int = 0
         line: int = 0
         column: int = 0
 
+        with open(path, "rb") as f:
+            text = f.read()
+        # NOTE: Chunks are hashed from a view on the text we've already read,
+        # so that we don't need to copy each chunk's bytes.
+        view = memoryview(text)
+
         def makeChunk(
-            offset: int, line: int, column: int, text: bytes
+            offset: int, line: int, column: int, end: int
         ) -> tuple[Chunk, int, int, int]:
-            n: int = len(text)
-            l: int = line + text.count(b"\n")
-            c: int = len(text) - max(0, text.rfind(b"\n"))
-            o: int = offset + n
+            n: int = end - offset
+            # NOTE: Chunks partition the text, so counting is linear over the
+            # file, and we only look for the last newline if there is one.
+            k: int = text.count(b"\n", offset, end)
+            l: int = line + k
+            c: int = n - max(0, text.rfind(b"\n", offset, end) - offset) if k else n
             return (
                 Chunk(
                     location=loc,
                     scope=Symbol([makeID()]),
                     range=Range(
                         TextPosition(offset, line, column),
-                        TextPosition(o, l, c),
+                        TextPosition(end, l, c),
                     ),
-                    signature=signature(path, offset, o),
+                    signature=signatureBytes(view[offset:end]),
                 ),
-                o,
+                end,
                 l,
                 c,
             )
 
-        with open(path, "rb") as f:
-            for match in RE_SEPARATOR_BYTES.finditer(text := f.read()):
-                # We generate the previous chunk
-                if (o := match.start()) > offset:
-                    chunk, offset, line, column = makeChunk(
-                        offset, line, column, text[offset:o]
-                    )
-                    yield chunk
-                    assert offset == o
-                chunk, offset, line, column = makeChunk(
-                    offset, line, column, text[o : match.end()]
-                )
-                assert offset == match.end()
-                yield chunk
-            if offset < len(text):
-                chunk, offset, line, column = makeChunk(
-                    offset, line, column, text[offset:]
-                )
+        for match in RE_SEPARATOR_BYTES.finditer(view):
+            # We generate the previous chunk
+            if (o := match.start()) > offset:
+                chunk, offset, line, column = makeChunk(offset, line, column, o)
                 yield chunk
+                assert offset == o
+            chunk, offset, line, column = makeChunk(offset, line, column, match.end())
+            assert offset == match.end()
+            yield chunk
+        if offset < len(text):
+            chunk, offset, line, column = makeChunk(offset, line, column, len(text))
+            yield chunk
+
+
+# --
+# Files are catalogued independently from each other, and the cataloguing
+# is CPU-bound (hashing and splitting), so we can spread the files across
+# processes.
+
+
+def listChunks(path: Path, base: Path = Path.cwd()) -> list[Chunk]:
+    """Returns the chunks available at the given `path`, see `iterChunks`."""
+    return list(iterChunks(path, base))
+
+
+def iterFilesChunks(
+    paths: Iterable[Path], base: Path = Path.cwd(), workers: Optional[int] = None
+) -> Iterator[list[Chunk]]:
+    """Iterates on the list of chunks of each of the given `paths`, in order,
+    using a pool of `workers` processes."""
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(partial(listChunks, base=base), paths, chunksize=16)
 
 
 def loadChunk(chunk: Chunk) -> bytes:
-    fd = os.open("/".join(chunk.location.path), os.O_RDONLY)
-    os.lseek(fd, chunk.range.start.offset, os.SEEK_SET)
-    data = os.read(fd, chunk.range.end.offset - chunk.range.start.offset)
-    os.close(fd)
-    return data
-
-
-# We iterate on the chunks on this specific file, and we make sure we got
-# the whole thing right.
-chunks: list[bytes] = []
-for chunk in iterChunks(path := Path(__file__)):
-    print(chunk)
-    data = loadChunk(chunk)
-    print("-->", data)
-    chunks.append(data)
-assert path.read_bytes() == b"".join(chunks)
+    # NOTE: `readRange` keeps a few recently used files open, as chunks
+    # typically come in batches from the same file.
+    return readRange(
+        "/".join(chunk.location.path), chunk.range.start.offset, chunk.range.end.offset
+    )
+
+
+if __name__ == "__main__":
+    # We iterate on the chunks on this specific file, and we make sure we got
+    # the whole thing right.
+    chunks: list[bytes] = []
+    for chunk in iterChunks(path := Path(__file__)):
+        print(chunk)
+        data = loadChunk(chunk)
+        print("-->", data)
+        chunks.append(data)
+    assert path.read_bytes() == b"".join(chunks)
+    # And we do the same for all the files in this directory, in parallel.
+    files: list[Path] = sorted(_ for _ in path.parent.iterdir() if _.is_file())
+    for file, file_chunks in zip(files, iterFilesChunks(files)):
+        assert file.read_bytes() == b"".join(loadChunk(_) for _ in file_chunks)
 
 # EOF
@@ -1,6 +1,8 @@
 from typing import NamedTuple
 from pathlib import Path
 from enum import Enum
+from functools import lru_cache
+from stat import S_ISREG, S_ISDIR, S_ISLNK
 import grp, pwd, os, mimetypes
 import magic
 from srcs.utils.files import Files, isBinary
@@ -58,6 +60,18 @@ class FileUser(NamedTuple):
     userName: str
 
 
+# NOTE: There are only a few distinct users and groups in a tree, and the
+# lookups may go through NSS (LDAP, etc), so we cache them.
+@lru_cache(maxsize=1024)
+def userName(uid: int) -> str:
+    return pwd.getpwuid(uid).pw_name
+
+
+@lru_cache(maxsize=1024)
+def groupName(gid: int) -> str:
+    return grp.getgrgid(gid).gr_name
+
+
 class FileAttributes(NamedTuple):
     owner: FileUser
     group: FileUser
@@ -65,17 +79,16 @@ class FileAttributes(NamedTuple):
     createdTime: float
     updatedTime: float
 
+    @classmethod
+    def FromPath(cls, path: Path) -> "FileAttributes":
+        return cls.FromStat(os.stat(path))
+
     @staticmethod
-    def FromPath(path: Path) -> "FileAttributes":
-        stat = os.stat(path)
+    def FromStat(stat: os.stat_result) -> "FileAttributes":
         return FileAttributes(
-            owner=FileUser(
-                userId=(uid := stat.st_uid), userName=pwd.getpwuid(uid).pw_name
-            ),
-            group=FileUser(
-                userId=(gid := stat.st_gid), userName=grp.getgrgid(gid).gr_name
-            ),
-            permissions=FilePermissions.FromPath(path),
+            owner=FileUser(userId=stat.st_uid, userName=userName(stat.st_uid)),
+            group=FileUser(userId=stat.st_gid, userName=groupName(stat.st_gid)),
+            permissions=FilePermissions.FromMode(stat.st_mode),
             createdTime=stat.st_ctime,
             updatedTime=stat.st_mtime,
         )
@@ -85,6 +98,13 @@ class FileAttributes(NamedTuple):
 # ## File Entries
 
 
+# NOTE: Loading the magic database is expensive, so we create a single
+# detector on first use and share it for all the files.
+@lru_cache(maxsize=1)
+def mimeDetector() -> magic.Magic:
+    return magic.Magic(mime=True)
+
+
 class FilePath(NamedTuple):
     parent: TPath
     name: str
@@ -124,20 +144,37 @@ class FileEntry(NamedTuple):
             # If the file extension does not provide the MIME type, try to read the content.
             # Note: Install the `python-magic` library first using `pip install python-magic`.
             try:
-                with magic.Magic() as magic_instance:
-                    detected_mime_type = magic_instance.from_file(str(path))
-                return detected_mime_type
+                return mimeDetector().from_file(str(path))
             except magic.MagicException:
                 return "application/octet-stream" if isBinary(path) else "text/plain"
 
+    @staticmethod
+    def TypeFromMode(mode: int, path: Path) -> FileType:
+        if S_ISREG(mode):
+            return FileType.File
+        elif S_ISDIR(mode):
+            return FileType.Dir
+        elif S_ISLNK(mode):
+            return FileType.Link
+        else:
+            raise ValueError(f"Unsupported file type for path: {path}")
+
     @classmethod
     def FromPath(cls, path: Path) -> "FileEntry":
+        # NOTE: Like `Type`, this follows symlinks, use `FromStat` with
+        # an `lstat` result to get links.
+        return cls.FromStat(path, os.stat(path))
+
+    @classmethod
+    def FromStat(cls, path: Path, stat: os.stat_result) -> "FileEntry":
+        """Creates the entry from a stat result, so that a single `stat` call
+        is made per entry."""
         return FileEntry(
             path=FilePath(parent=list(map(str, path.parents)), name=path.name),
-            type=cls.Type(path),
+            type=cls.TypeFromMode(stat.st_mode, path),
             ext=path.suffix,
             mimeType="",  # You may fill in the MIME type if available.
-            attr=FileAttributes.FromPath(path),
+            attr=FileAttributes.FromStat(stat),
         )
 
 
@@ -161,7 +198,7 @@ def filePredicate(path: Path) -> bool:
 
 def fileTree(base: Path) -> "FileTree":
     """Returns a tree representation of the files at the given path."""
-    for atom in Files.Walk(base, predicate=filePredicate):
+    for atom in Files.WalkPaths(base, predicate=filePredicate):
         print(fileEntry(atom))
 
 
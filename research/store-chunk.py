@@ -39,7 +39,7 @@ class ChunkStore:
         return self.root / f"{('/'.join(self.key(chunk)))}.chunk"
 
     def list(self) -> Iterator[tuple[Type[Chunk], bytes]]:
-        for path in Files.Walk(self.root):
+        for path in Files.WalkPaths(self.root):
             if path.name.endswith(".chunk"):
                 key = [_ for _ in path._parts]
                 key[-1] = key[-1].rstrip(".chunk")
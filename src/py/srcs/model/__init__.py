@@ -6,5 +6,6 @@ from .chunks import (  # NOQA: F401
     HashType,
     Signature,
     signatureFromFile,
+    signatureFromBytes,
     Chunk,
 )
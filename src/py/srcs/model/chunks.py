@@ -1,8 +1,11 @@
 from typing import NamedTuple, Optional, TypeVar
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 from hashlib import sha512
 import os
+import mmap
+from ..utils.files import readRange
 
 T = TypeVar("T")
 
@@ -63,13 +66,22 @@ class Range(NamedTuple):
 # program.
 
 
+# NOTE: The same base is used to locate all the files of a tree, so we
+# cache its resolution, which otherwise stats each of its components.
+@lru_cache(maxsize=256)
+def resolvedPath(path: str) -> Path:
+    return Path(path).resolve()
+
+
 class Location(NamedTuple):
     path: tuple[str, ...]
 
     @staticmethod
     def Get(path: Path, base: Path) -> "Location":
         """Creates a location object from a local path and a base."""
-        return Location(path.resolve().relative_to(base.resolve()).parts)
+        return Location(
+            path.resolve().relative_to(resolvedPath(str(base.absolute()))).parts
+        )
 
     @staticmethod
     def Path(location: "Location", base: Path = Path.cwd()) -> Path:
@@ -85,6 +97,11 @@ class Signature(NamedTuple):
     hash: bytes
 
 
+# NOTE: Files above that size are memory mapped and hashed in a single
+# call, smaller files are read in a single call, as mapping has a setup cost.
+SIGNATURE_MMAP_SIZE: int = 128 * 1024
+
+
 def signatureFromFile(
     path: Path, start: Optional[int] = None, end: Optional[int] = None
 ) -> "Signature":
@@ -92,20 +109,27 @@ def signatureFromFile(
     offsets to calculate the signature of a subset"""
     h = sha512()
     with path.open("rb") as file:
-        if start:
-            file.seek(start)
-        if end is None:
-            for chunk in iter(lambda: file.read(1024), b""):
-                h.update(chunk)
+        # The file is read sequentially, which lets the kernel use a larger
+        # readahead window.
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if os.fstat(file.fileno()).st_size >= SIGNATURE_MMAP_SIZE:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data)[start or 0 : end] as view:
+                    h.update(view)
         else:
-            to_read = end - (start or 0)
-            while to_read > 0:
-                chunk = file.read(min(1024, to_read))
-                h.update(chunk)
-                to_read -= len(chunk)
+            if start:
+                file.seek(start)
+            h.update(file.read() if end is None else file.read(max(0, end - (start or 0))))
     return Signature(HashType.SHA512.value, h.digest())
 
 
+def signatureFromBytes(data: bytes | memoryview) -> "Signature":
+    """Returns the SHA512 signature for the given data, typically a subset
+    of a file that was already read."""
+    return Signature(HashType.SHA512.value, sha512(data).digest())
+
+
 class Chunk(NamedTuple):
     location: Location
     range: Range
@@ -113,11 +137,11 @@ class Chunk(NamedTuple):
 
     @staticmethod
     def Read(chunk: "Chunk", path: Path = Path.cwd()) -> bytes:
-        fd = os.open(str(Location.Path(chunk.location, path)), os.O_RDONLY)
-        os.lseek(fd, chunk.range.start.offset, 0)
-        data = os.read(fd, chunk.range.end.offset - chunk.range.start.offset)
-        os.close(fd)
-        return data
+        return readRange(
+            Location.Path(chunk.location, path),
+            chunk.range.start.offset,
+            chunk.range.end.offset,
+        )
 
 
 # --
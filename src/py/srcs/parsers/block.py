@@ -1,4 +1,5 @@
 from typing import Iterator
+from itertools import chain
 import re
 from pathlib import Path
 from ..utils.files import isBinary
@@ -9,6 +10,7 @@ from ..model import (
     TextPosition,
     Location,
     signatureFromFile,
+    signatureFromBytes,
 )
 
 # NOTE: We probably want to implement per-file-format chunk iterator. We
@@ -17,6 +19,30 @@ from ..model import (
 RE_SEPARATOR_BYTES = re.compile(b"\r?\n([\t ]*\r?\n)+")
 
 
+def textRanges(text: bytes) -> Iterator[Range]:
+    """Iterates on the ranges of the blocks of the given `text`, the blocks
+    being separated by empty lines, which are blocks themselves."""
+    # NOTE: This is the hot loop of the parser, it is kept as a plain typed
+    # function so that it compiles well with `make compile-mypyc`.
+    offset: int = 0
+    line: int = 0
+    column: int = 0
+    for end in chain(
+        (_ for m in RE_SEPARATOR_BYTES.finditer(text) for _ in (m.start(), m.end())),
+        (len(text),),
+    ):
+        # The text before a separator may be empty, and is skipped then
+        if end > offset:
+            n: int = end - offset
+            # NOTE: Chunks partition the text, so counting is linear over
+            # the file, and we only look for the last newline if any.
+            k: int = text.count(b"\n", offset, end)
+            l: int = line + k
+            c: int = n - max(0, text.rfind(b"\n", offset, end) - offset) if k else n
+            yield Range(TextPosition(offset, line, column), TextPosition(end, l, c))
+            offset, line, column = end, l, c
+
+
 class BlockParser:
     @staticmethod
     def Chunks(path: Path, base: Path = Path.cwd()) -> Iterator[Chunk]:
@@ -31,49 +57,16 @@ class BlockParser:
                 signature=signatureFromFile(path),
             )
         else:
-            offset: int = 0
-            line: int = 0
-            column: int = 0
-
-            def makeChunk(
-                offset: int, line: int, column: int, text: bytes
-            ) -> tuple[Chunk, int, int, int]:
-                n: int = len(text)
-                l: int = line + text.count(b"\n")
-                c: int = len(text) - max(0, text.rfind(b"\n"))
-                o: int = offset + n
-                return (
-                    Chunk(
-                        location=loc,
-                        range=Range(
-                            TextPosition(offset, line, column),
-                            TextPosition(o, l, c),
-                        ),
-                        signature=signatureFromFile(path, offset, o),
-                    ),
-                    o,
-                    l,
-                    c,
-                )
-
             with open(path, "rb") as f:
-                for match in RE_SEPARATOR_BYTES.finditer(text := f.read()):
-                    # We generate the previous chunk
-                    if (o := match.start()) > offset:
-                        chunk, offset, line, column = makeChunk(
-                            offset, line, column, text[offset:o]
-                        )
-                        yield chunk
-                        assert offset == o  # nosec: B101
-                    chunk, offset, line, column = makeChunk(
-                        offset, line, column, text[o : match.end()]
-                    )
-                    assert offset == match.end()  # nosec: B101
-                    yield chunk
-                if offset < len(text):
-                    chunk, offset, line, column = makeChunk(
-                        offset, line, column, text[offset:]
-                    )
-                    yield chunk
+                text = f.read()
+            # NOTE: Chunks are hashed from a view on the text we've already
+            # read, instead of re-reading each chunk from the file.
+            view = memoryview(text)
+            for r in textRanges(text):
+                yield Chunk(
+                    location=loc,
+                    range=r,
+                    signature=signatureFromBytes(view[r.start.offset : r.end.offset]),
+                )
 
     # EOF
@@ -4,12 +4,10 @@
 from typing import Iterator, Type
 from srcs.model import Chunk
 from srcs.parsers import BlockParser
-from srcs.utils.ids import strchunks
-from srcs.utils.files import Files
+from srcs.utils.files import Files, readRange
 from pathlib import Path
 from math import ceil
 import os
-import base64
 
 
 TKey = list[str]
@@ -25,53 +23,98 @@ TKey = list[str]
 class ChunkStore:
     def __init__(self, path: Path | str):
         self.root = (Path(path) if isinstance(path, str) else path).absolute()
-
-    def put(self, chunk: Chunk):
+        # The paths saved since the last `flush()`
+        self.unflushed: set[Path] = set()
+        # The directories known to exist, chunks share directory prefixes
+        # so this saves a `mkdir` per chunk.
+        self.directories: set[Path] = set()
+        # The directories created since the last `flush()`, their entries
+        # live in their parents, which need to be synced as well.
+        self.created: set[Path] = set()
+
+    def put(self, chunk: Chunk, data: bytes | memoryview | None = None):
+        """Puts the chunk in the store. When the caller already has the chunk's
+        `data`, it is written as-is instead of being read again from the
+        chunk's location."""
         path = self.path(chunk)
-        path.parent.mkdir(parents=True, exist_ok=True)
-        self.save(chunk, path=self.path(chunk))
-        pass
+        # NOTE: Chunks are keyed by their signature, so an existing chunk
+        # already has the right contents. Saving it again would truncate it
+        # until the next `flush()`.
+        if path.exists():
+            return
+        if (parent := path.parent) not in self.directories:
+            missing = parent
+            while not missing.exists():
+                self.created.add(missing)
+                missing = missing.parent
+            parent.mkdir(parents=True, exist_ok=True)
+            self.directories.add(parent)
+        self.save(chunk, data, path=path)
 
     def key(self, chunk: Chunk) -> TKey:
-        return strchunks(self.encodeSignature(chunk.signature.hash))
+        # NOTE: Like git objects, chunks are fanned out in directories named
+        # after the first byte of their signature.
+        key = self.encodeSignature(chunk.signature.hash)
+        return [key[:2], key[2:]]
 
     def path(self, chunk: Chunk) -> Path:
         return self.root / f"{('/'.join(self.key(chunk)))}.chunk"
 
     def list(self) -> Iterator[tuple[Type[Chunk], bytes]]:
-        for path in Files.Walk(self.root):
-            if path.name.endswith(".chunk"):
-                key = [_ for _ in path._parts]
-                key[-1] = key[-1].rstrip(".chunk")
-                yield (Chunk, self.decodeSignature("".join(key)))
+        for paths in Files.WalkBatches(self.root):
+            for path in paths:
+                if path.endswith(".chunk"):
+                    key = path.split(os.sep)
+                    key[-1] = key[-1].removesuffix(".chunk")
+                    yield (Chunk, self.decodeSignature("".join(key)))
 
     # TODO: Load/Save should be orthogonal, I think we should probably have
     # an LZMA option?
     def load(
         self, chunk: Chunk, cwd: Path = Path.cwd(), *, path: Path | None = None
     ) -> bytes:
-        fd = os.open(
-            str(path or (cwd / "/".join(chunk.location.path))), os.O_RDONLY | os.O_RSYNC
+        return readRange(
+            path or (cwd / "/".join(chunk.location.path)),
+            chunk.range.start.offset,
+            chunk.range.end.offset,
         )
-        os.lseek(fd, chunk.range.start.offset, os.SEEK_SET)
-        data = os.read(fd, chunk.range.end.offset - chunk.range.start.offset)
-        os.close(fd)
-        return data
 
-    def save(self, chunk: Chunk, *, path: Path | None = None) -> bool:
-        # We try a direct write so that we ensure it's committed properly
-        fd = os.open(
-            str(path or self.path(chunk)), os.O_WRONLY | os.O_CREAT | os.O_SYNC
-        )
-        os.write(fd, self.load(chunk))
+    def save(
+        self,
+        chunk: Chunk,
+        data: bytes | memoryview | None = None,
+        *,
+        path: Path | None = None,
+    ) -> bool:
+        # NOTE: Writes are buffered, as synchronous writes would block on
+        # every chunk. Use `flush()` once a batch of chunks has been saved
+        # to ensure it's committed properly.
+        path = path or self.path(chunk)
+        fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        os.write(fd, self.load(chunk) if data is None else data)
         os.close(fd)
+        self.unflushed.add(path)
         return True
 
+    def flush(self) -> None:
+        """Commits the chunks saved since the last flush to disk, including
+        the directory entries that reference them."""
+        for path in (
+            self.unflushed
+            | {_.parent for _ in self.unflushed}
+            | {_.parent for _ in self.created}
+        ):
+            fd = os.open(str(path), os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+        self.unflushed.clear()
+        self.created.clear()
+
     def encodeSignature(self, data: bytes) -> str:
-        return str(base64.b32encode(data), "ascii")
+        return data.hex()
 
     def decodeSignature(self, data: str) -> bytes:
-        return base64.b32decode(data)
+        return bytes.fromhex(data)
 
 
 # EOF
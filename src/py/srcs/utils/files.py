@@ -1,7 +1,21 @@
-from typing import Generator, Union, Optional, ContextManager, Callable
+from typing import (
+    Generator,
+    Union,
+    Optional,
+    ContextManager,
+    Callable,
+    Iterable,
+    Iterator,
+)
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from sys import getdefaultencoding
+from collections import OrderedDict
+from threading import Lock
+from stat import S_ISDIR
 import os
+import errno
+import mmap
 import json
 import tempfile
 import shutil
@@ -11,16 +25,68 @@ import hashlib
 ENCODING = getdefaultencoding()
 
 
-def sha256sum(path: Union[Path, str], buffer=64_000) -> str:
-    res = hashlib.sha256()
-    with open(path, "rb") as file:
-        for byte_block in iter(
-            lambda: file.read(buffer), b""
-        ):  # read and update hash string value in blocks of 4K
-            res.update(byte_block)
+# NOTE: Files above that size are memory mapped and hashed straight from the
+# page cache, which saves copying them through userspace buffers.
+SHA256_MMAP_SIZE: int = 16 * 1024 * 1024
+
+# NOTE: Copying an empty hasher is a bit cheaper than creating a new one,
+# which adds up when hashing many small files.
+SHA256_EMPTY = hashlib.sha256()
+
+
+def sha256sum(
+    path: Union[Path, str], buffer: int = 1 << 20, maxBytes: Optional[int] = None
+) -> str:
+    """Returns the hex SHA-256 digest of the file at the given path. When
+    `maxBytes` is given, only the size and the first `maxBytes` bytes are
+    hashed: the result is then a content id for change detection, not the
+    digest of the file."""
+    with open(path, "rb", buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+        if maxBytes is not None:
+            res = SHA256_EMPTY.copy()
+            res.update(size.to_bytes(8, "little"))
+            remaining = min(maxBytes, size)
+            view = memoryview(bytearray(min(buffer, remaining)))
+            while remaining > 0 and (n := file.readinto(view[:remaining])):
+                res.update(view[:n])
+                remaining -= n
+            return res.hexdigest()
+        elif size > SHA256_MMAP_SIZE:
+            try:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if hasattr(data, "madvise"):
+                        data.madvise(mmap.MADV_SEQUENTIAL)
+                    res = SHA256_EMPTY.copy()
+                    res.update(data)
+                    return res.hexdigest()
+            except OSError:
+                # Some files (pipes, special filesystems) can't be mapped,
+                # we hash them the regular way.
+                pass
+        # NOTE: `file_digest` (3.11+) reads into a reusable buffer and hashes
+        # it in C, without going back to the interpreter for each block.
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(file, SHA256_EMPTY.copy).hexdigest()
+        res = SHA256_EMPTY.copy()
+        buf = bytearray(buffer)
+        view = memoryview(buf)
+        while n := file.readinto(buf):
+            res.update(view[:n])
         return res.hexdigest()
 
 
+def sha256sumMany(
+    paths: Iterable[Union[Path, str]], workers: Optional[int] = None
+) -> dict[Union[Path, str], str]:
+    """Returns the hex SHA-256 digests of the given `paths`, hashed in parallel
+    by a pool of `workers` processes. Paths are best sorted by decreasing size
+    so that the largest files don't end up last in a worker's queue."""
+    paths = list(paths)
+    with ProcessPoolExecutor(workers) as executor:
+        return dict(zip(paths, executor.map(sha256sum, paths, chunksize=16)))
+
+
 class mkdtemp(ContextManager):
     """Crates a temporary the given contents."""
 
@@ -46,10 +112,10 @@ class mkstemp(ContextManager):
         super().__init__()
         self.content = content.encode(ENCODING) if isinstance(content, str) else content
         fd, path = tempfile.mkstemp(prefix="ss-", suffix=".cry")
-        if content is not None:
-            os.write(
-                fd, bytes(content, "utf8") if isinstance(content, str) else content
-            )
+        try:
+            if self.content is not None:
+                os.write(fd, self.content)
+        finally:
             os.close(fd)
         self.path: Path = Path(path)
 
@@ -61,6 +127,37 @@ class mkstemp(ContextManager):
             self.path.unlink()
 
 
+def raiseError(error: OSError) -> None:
+    """Re-raises the errors reported by `os.walk`, which would otherwise
+    silently skip the directories it can't list."""
+    raise error
+
+
+def walkTree(
+    root: str, followLinks: bool = False
+) -> Iterator[tuple[str, list[str], list[str]]]:
+    """Walks the tree at `root` top-down, like `os.walk`, so that pruning the
+    directory names skips them. The root itself is always followed when it is
+    a symlink, `followLinks` only applies to the links below it. Errors are
+    raised, as an incomplete listing would go unnoticed."""
+    if hasattr(os, "fwalk"):
+        # On POSIX, `fwalk` descends using file descriptors relative to the
+        # parent directory, so path components are not looked up again. It
+        # won't enter a symlinked root unless following links, so we walk
+        # its target instead and map the paths back under `root`.
+        top = root if followLinks else os.path.realpath(root)
+        # `fwalk` yields nothing for a root that isn't a directory, where
+        # `os.walk` reports an error.
+        if not S_ISDIR(os.stat(top).st_mode):
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), root)
+        for dirpath, dirnames, filenames, _ in os.fwalk(
+            top, follow_symlinks=followLinks, onerror=raiseError
+        ):
+            yield root + dirpath[len(top) :], dirnames, filenames
+    else:
+        yield from os.walk(root, followlinks=followLinks, onerror=raiseError)
+
+
 # NOTE: This is borrowed and adapted from  <https://github.com/sebastien/sink>
 class Files:
     """An abstraction of key operations involved in snapshotting filesystems"""
@@ -69,11 +166,15 @@ class Files:
     def Write(path: Union[str, Path], content: Union[bytes, str, dict]) -> Path:
         p = Path(path)
         p.parent.mkdir(parents=True, exist_ok=True)
-        with open(p, "wb" if isinstance(content, bytes) else "wt") as f:
-            if isinstance(content, str) or isinstance(content, bytes):
+        with open(p, "wb", buffering=1 << 20) as f:
+            if isinstance(content, bytes):
                 f.write(content)
+            elif isinstance(content, str):
+                f.write(content.encode(ENCODING))
             else:
-                json.dump(content, f)
+                # NOTE: `json.dumps` encodes in C in one go, where `json.dump`
+                # iterates on many small chunks written one by one.
+                f.write(json.dumps(content, separators=(",", ":")).encode("ascii"))
         return p
 
     @staticmethod
@@ -81,58 +182,213 @@ class Files:
         path: Union[str, Path],
         followLinks: bool = False,
         includeDir: bool = False,
-        predicate: Callable[[Path], bool] | None = None,
-    ) -> Generator[Path, bool, None]:
-        """Does a breadth-first walk of the filesystem, yielding non-directory
+        predicate: Callable[[str], bool] | None = None,
+    ) -> Generator[str, bool, None]:
+        """Does a top-down walk of the filesystem, yielding non-directory
         paths that match the `accepts` and `rejects` filters."""
-        queue: list[Path | str] = ["."]
-        root = Path(path).absolute()
-        while queue:
-            local_path = queue.pop()
-            abs_path = root / local_path
-            # TODO: It may be better to use os.walk there...
-            for name in os.listdir(abs_path):
-                item_abs_path = abs_path / name
-                item_rel_path = item_abs_path.relative_to(root)
-                is_link = os.path.islink(item_abs_path)
-                is_dir = item_abs_path.resolve().is_dir()
+        # NOTE: Paths are relative strings, as creating `Path` objects for each
+        # entry dominates the cost of the walk. Use `WalkPaths` to get `Path`s.
+        root = str(Path(path).absolute())
+        for dirpath, dirnames, filenames in walkTree(root, followLinks):
+            local_path = dirpath[len(root) :].lstrip(os.sep)
+            # Directories rejected by the predicate or by the caller are pruned
+            # in place, so that the walk doesn't descend into them.
+            descend: list[str] = []
+            for name in dirnames:
+                item_rel_path = os.path.join(local_path, name) if local_path else name
                 if predicate and not predicate(item_rel_path):
                     continue
-                elif not (is_dir and includeDir is False):
-                    continues = yield item_rel_path
-                else:
-                    continues = True
-                if continues is False:
+                elif includeDir and (yield item_rel_path) is False:
                     continue
-                elif is_link and not followLinks:
-                    pass
-                elif is_dir:
-                    queue.append(item_rel_path)
+                descend.append(name)
+            dirnames[:] = descend
+            for name in filenames:
+                item_rel_path = os.path.join(local_path, name) if local_path else name
+                if predicate and not predicate(item_rel_path):
+                    continue
+                yield item_rel_path
+
+    @staticmethod
+    def WalkBatches(
+        path: Union[str, Path],
+        followLinks: bool = False,
+        includeDir: bool = False,
+        size: int = 1024,
+    ) -> Iterator[list[str]]:
+        """Walks the filesystem like `Walk`, without filtering, yielding the
+        relative paths in lists of `size` items. This avoids resuming the
+        generator for each path when listing large trees."""
+        if size <= 0:
+            raise ValueError(f"Batch size must be positive, got: {size}")
+        root = str(Path(path).absolute())
+        batch: list[str] = []
+        for dirpath, dirnames, filenames in walkTree(root, followLinks):
+            local_path = dirpath[len(root) :].lstrip(os.sep)
+            prefix = f"{local_path}{os.sep}" if local_path else ""
+            if includeDir:
+                batch.extend(prefix + _ for _ in dirnames)
+            batch.extend(prefix + _ for _ in filenames)
+            while len(batch) >= size:
+                yield batch[:size]
+                del batch[:size]
+        if batch:
+            yield batch
+
+    @staticmethod
+    def WalkPaths(
+        path: Union[str, Path],
+        followLinks: bool = False,
+        includeDir: bool = False,
+        predicate: Callable[[Path], bool] | None = None,
+    ) -> Generator[Path, bool, None]:
+        """Like `Walk`, but yields relative `Path` objects, and passes them to
+        the `predicate`."""
+        walk = Files.Walk(
+            path,
+            followLinks=followLinks,
+            includeDir=includeDir,
+            predicate=(lambda _: predicate(Path(_))) if predicate else None,
+        )
+        try:
+            item = next(walk)
+            while True:
+                # The values sent to this generator are forwarded to the walk
+                item = walk.send((yield Path(item)))
+        except StopIteration:
+            return
+
+
+# NOTE: Chunks are typically read in batches from the same files, so we keep
+# a few of the recently used files open and read ranges with `pread`. Unlike
+# a mapping, reading a file truncated in the meantime returns fewer bytes
+# instead of crashing. A descriptor is reopened when its path points to
+# a different file, and closed when the file is gone.
+class OpenFile:
+    """A descriptor kept open by `readRange`, along with the identity of the
+    file it points to. The lock is only held to look descriptors up, so
+    a descriptor evicted while being read is closed by its last reader."""
+
+    __slots__ = ("fd", "dev", "ino", "readers", "evicted")
+
+    def __init__(self, fd: int):
+        stat = os.fstat(fd)
+        self.fd: int = fd
+        self.dev: int = stat.st_dev
+        self.ino: int = stat.st_ino
+        self.readers: int = 1
+        self.evicted: bool = False
+
+    def evict(self) -> None:
+        self.evicted = True
+        if not self.readers:
+            os.close(self.fd)
+
+    def release(self) -> None:
+        self.readers -= 1
+        if self.evicted and not self.readers:
+            os.close(self.fd)
+
+
+OPEN_FILES_MAX: int = 16
+OPEN_FILES: OrderedDict[str, OpenFile] = OrderedDict()
+OPEN_FILES_LOCK: Lock = Lock()
+
+
+def closeFiles() -> None:
+    """Closes the descriptors kept open by `readRange`."""
+    with OPEN_FILES_LOCK:
+        while OPEN_FILES:
+            OPEN_FILES.popitem()[1].evict()
+
+
+def resetFiles() -> None:
+    """Resets the lock, which forked processes must do as it may have been
+    held at the time of the fork."""
+    global OPEN_FILES_LOCK
+    OPEN_FILES_LOCK = Lock()
+
+
+# NOTE: Platforms without `fork` (Windows) have no `register_at_fork`.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetFiles)
+
+
+def readRange(path: Union[str, Path], start: int, end: int) -> bytes:
+    """Reads the bytes between `start` and `end` in the file at the given path."""
+    key = str(path)
+    try:
+        stat = os.stat(key)
+    except OSError:
+        with OPEN_FILES_LOCK:
+            if gone := OPEN_FILES.pop(key, None):
+                gone.evict()
+        raise
+    with OPEN_FILES_LOCK:
+        entry = OPEN_FILES.get(key)
+        if entry and (entry.dev, entry.ino) == (stat.st_dev, stat.st_ino):
+            OPEN_FILES.move_to_end(key)
+            entry.readers += 1
+        else:
+            entry = None
+    if not entry:
+        entry = OpenFile(os.open(key, os.O_RDONLY))
+        with OPEN_FILES_LOCK:
+            if previous := OPEN_FILES.pop(key, None):
+                previous.evict()
+            OPEN_FILES[key] = entry
+            while len(OPEN_FILES) > OPEN_FILES_MAX:
+                OPEN_FILES.popitem(last=False)[1].evict()
+    try:
+        res: list[bytes] = []
+        offset = start
+        while offset < end and (data := os.pread(entry.fd, end - offset, offset)):
+            res.append(data)
+            offset += len(data)
+    finally:
+        with OPEN_FILES_LOCK:
+            entry.release()
+    return res[0] if len(res) == 1 else b"".join(res)
+
+
+# NOTE: Binary detection deletes the text bytes from the read blocks, which
+# happens in C, anything left over means binary content.
+BINARY_BYTES: bytes = bytes(range(0x09)) + bytes(range(0x0E, 0x20))
+TEXT_BYTES: bytes = bytes(_ for _ in range(256) if _ not in BINARY_BYTES)
 
 
 def isBinary(path: Path) -> bool:
     """Checks if the given path has binary contents or not"""
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024), b""):
-            if b"\0" in chunk:
-                return True
-            if any(b < 0x09 or (0x0E <= b <= 0x1F) for b in chunk):
+    with open(path, "rb", buffering=0) as f:
+        # Most binary files have a NUL byte early on, which we look for
+        # in a small first block before doing the full scan.
+        chunk = f.read(4096)
+        if b"\0" in chunk or chunk.translate(None, TEXT_BYTES):
+            return True
+        # The rest is read in a reused buffer, which is truncated in place
+        # for the last partial block.
+        buffer = bytearray(65536)
+        while n := f.readinto(buffer):
+            if n < len(buffer):
+                del buffer[n:]
+            if b"\0" in buffer or buffer.translate(None, TEXT_BYTES):
                 return True
     return False
 
 
 def dotfile(name: str, base: Optional[Path] = None) -> Optional[Path]:
-    """Looks for the file `name` in the current directory or its ancestors"""
-    user_home: Optional[str] = os.getenv("HOME")
-    path = Path(base or ".").absolute()
-    while path != path.parent:
-        if (loc := path / name).exists():
+    """Looks for the file `name` in the current directory or its ancestors,
+    stopping at the user's home directory."""
+    home: Optional[str] = os.getenv("HOME")
+    # NOTE: Both paths are resolved, as the home directory may be reached
+    # through a symlink, which would never compare equal otherwise.
+    user_home: Optional[Path] = Path(home).resolve() if home else None
+    path = Path(base or ".").resolve()
+    while True:
+        if os.path.exists(loc := path / name):
             return loc
-        if path != user_home:
-            path = path.parent
-        else:
-            break
-    return None
+        elif path == user_home or path == path.parent:
+            return None
+        path = path.parent
 
 
 # EOF
@@ -1,4 +1,5 @@
-from math import floor, ceil
+from functools import lru_cache
+from threading import Lock
 import os, time
 
 CHARS: str = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
@@ -6,10 +7,13 @@ CHARS: str = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 def strhash(text: str, seed: int = 5381) -> int:
     """Returns a hash for the given text"""
-    hash_value = 5381
-    for char in text:
-        hash_value = (hash_value * 33) ^ ord(char)
-    return hash_value & 0xFFFFFFFF
+    # NOTE: Both the multiplication and the xor preserve the value modulo
+    # 2**32, so we mask at each step, which keeps the value a small int
+    # instead of a bignum that grows with the text.
+    hash_value = seed & 0xFFFFFFFF
+    for code in map(ord, text):
+        hash_value = ((hash_value * 33) ^ code) & 0xFFFFFFFF
+    return hash_value
 
 
 def numcode(num: int, alphabet: str = CHARS) -> str:
@@ -17,54 +21,88 @@ def numcode(num: int, alphabet: str = CHARS) -> str:
     res: list[str] = []
     n: int = len(alphabet)
     v: int = abs(num)
-    while v > 0:
-        res.insert(0, alphabet[v % n])
-        v = floor(v / n)
+    # NOTE: Digits come least significant first, so we append them and
+    # reverse once at the end.
+    while v:
+        v, r = divmod(v, n)
+        res.append(alphabet[r])
+    res.reverse()
     return "".join(res)
 
 
+# NOTE: Random bytes are drawn from `os.urandom` in batches, so that creating
+# ids doesn't make a system call each time.
+RANDOM_POOL_SIZE: int = 4095
+RANDOM_POOL: bytes = b""
+RANDOM_OFFSET: int = 0
+RANDOM_LOCK: Lock = Lock()
+
+
+def resetRandom() -> None:
+    """Discards the pool of random bytes, which forked processes must do so
+    that they don't reuse the parent's bytes."""
+    global RANDOM_POOL, RANDOM_OFFSET, RANDOM_LOCK
+    RANDOM_POOL = b""
+    RANDOM_OFFSET = 0
+    RANDOM_LOCK = Lock()
+
+
+# NOTE: Platforms without `fork` (Windows) have no `register_at_fork`.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=resetRandom)
+
+
+def randomBytes(count: int) -> bytes:
+    """Returns `count` random bytes taken from the pool."""
+    global RANDOM_POOL, RANDOM_OFFSET
+    with RANDOM_LOCK:
+        if RANDOM_OFFSET + count > len(RANDOM_POOL):
+            RANDOM_POOL = os.urandom(max(count, RANDOM_POOL_SIZE))
+            RANDOM_OFFSET = 0
+        offset = RANDOM_OFFSET
+        RANDOM_OFFSET += count
+        return RANDOM_POOL[offset : offset + count]
+
+
 def jid(node: int = 0) -> str:
     """Creates an id that contains a timestamp, a node id and some random
     factor, that should make the jobs ids largely sortable"""
     t: str = numcode(time.clock_gettime_ns(time.CLOCK_TAI)).rjust(14, "0")[:14]
     n: str = numcode(node).rjust(4, "0")[:4]
     # NOTE: math.log(math.pow(2,3 * 8), 62) ~ 3
-    r = numcode(int.from_bytes(os.urandom(3))).rjust(4, "0")[:4]
+    r = numcode(int.from_bytes(randomBytes(3))).rjust(4, "0")[:4]
     return f"{t}-{n}-{r}"
 
 
 def strencode(data: bytes, mapping: str = CHARS) -> str:
-    n: int = len(mapping)
-    num = int.from_bytes(data, byteorder="big")
-    encoded: list[str] = []
-    while num > 0:
-        num, remainder = divmod(num, n)
-        encoded.append(mapping[remainder])
-    return "".join(encoded)
+    """Encodes the given data using the characters in `mapping`, most
+    significant digit first, as expected by `strdecode`."""
+    return numcode(int.from_bytes(data, byteorder="big"), mapping)
 
 
-def strdecode(encoded: str, mapping: str = CHARS) -> bytes:
+@lru_cache(maxsize=16)
+def decodingTable(mapping: str) -> dict[str, int]:
+    """Returns a table mapping the characters of `mapping` to their index."""
+    return {c: i for i, c in enumerate(mapping)}
+
 
+def strdecode(encoded: str, mapping: str = CHARS) -> bytes:
+    """Decodes an `encoded` string produced by `strencode` with the same
+    `mapping`."""
     n = len(mapping)
+    table = decodingTable(mapping)
     num = 0
     for char in encoded:
-        if char not in CHARS:
+        if (digit := table.get(char)) is None:
             raise ValueError(f"Invalid character in encoded string: {char}")
-
-        num = num * n + CHARS.index(char)
+        num = num * n + digit
 
     # Convert the integer back to bytes
     return num.to_bytes((num.bit_length() + 7) // 8, byteorder="big")
 
 
 def strchunks(text: str, size: int = 10) -> list[str]:
-    n = ceil(len(text) / size)
-    res: list[str] = []
-    o: int = 0
-    while o < n:
-        res.append(text[o * size : (o + 1) * size])
-        o += 1
-    return res
+    return [text[i : i + size] for i in range(0, len(text), size)]
 
 
 # EOF
@@ -1,4 +1,7 @@
+from typing import Iterator
 import subprocess  # nosec: B404
+import selectors
+import os
 
 
 class CommandError(Exception):
@@ -12,19 +15,70 @@ class CommandError(Exception):
         return f"CommandError: '{' '.join(self.command)}', failed with status {self.status}: {self.err}"
 
 
-# FIXME: Does not do streaming
+def shellStream(
+    command: list[str],
+    cwd: str | None = None,
+    input: bytes | None = None,
+    chunk: int = 1 << 16,
+) -> Iterator[bytes]:
+    """Runs a shell command, yielding its stdout as it is produced, and raising
+    a `CommandError` with the stderr if the command fails."""
+    err: list[bytes] = []
+    with subprocess.Popen(  # nosec: B603
+        command,
+        cwd=cwd,
+        stdin=None if input is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as process:
+        # NOTE: The input is written and the outputs read as the pipes become
+        # ready, so that neither side blocks on a full pipe.
+        pending = memoryview(input or b"")
+        stdout, stderr = process.stdout, process.stderr
+        assert stdout is not None and stderr is not None  # nosec: B101
+        # NOTE: When the consumer stops early, the command is killed, as
+        # exiting `Popen` would otherwise wait for it to finish by itself.
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(stdout, selectors.EVENT_READ)
+                selector.register(stderr, selectors.EVENT_READ)
+                if process.stdin and pending:
+                    os.set_blocking(process.stdin.fileno(), False)
+                    selector.register(process.stdin, selectors.EVENT_WRITE)
+                elif process.stdin:
+                    process.stdin.close()
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        if key.fileobj is process.stdin:
+                            try:
+                                written = os.write(key.fd, pending[:chunk])
+                                pending = pending[written:]
+                            except BlockingIOError:
+                                continue
+                            except BrokenPipeError:
+                                pending = pending[:0]
+                            if not pending:
+                                selector.unregister(key.fileobj)
+                                process.stdin.close()
+                        elif not (data := os.read(key.fd, chunk)):
+                            selector.unregister(key.fileobj)
+                        elif key.fileobj is stdout:
+                            yield data
+                        else:
+                            err.append(data)
+        except BaseException:
+            process.kill()
+            raise
+        status = process.wait()
+    if status != 0:
+        raise CommandError(command, status, b"".join(err))
+
+
 def shell(
     command: list[str], cwd: str | None = None, input: bytes | None = None
 ) -> bytes:
     """Runs a shell command, and returns the stdout as a byte output"""
-    # FROM: https://stackoverflow.com/questions/163542/how-do-i-pass-a-string-into-subprocess-popen-using-the-stdin-argument#165662
-    res = subprocess.run(  # nosec: B603
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, input=input
-    )
-    if res.returncode == 0:
-        return res.stdout
-    else:
-        raise CommandError(command, res.returncode, res.stderr)
+    return b"".join(shellStream(command, cwd, input))
 
 
 # EOF